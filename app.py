@@ -3,14 +3,14 @@ import xarray as xr
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-import base64
 from utils import (
     load_continents, get_country_centroids,
-    categorize_spei, get_region_spei_values,
-    create_mapbox_figure, find_nearest_time_index,
+    categorize_spei, categorize_spei_array,
+    create_mapbox_figure, find_nearest_time_index, time_values_to_ordinals,
     create_region_slices, get_regions_dict,
-    calculate_category_count, SPEI_CATEGORIES,
-    prepare_mapbox_data
+    SPEI_CATEGORIES,
+    prepare_mapbox_data, sampling_window_labels, category_histogram_by_group,
+    mean_by_group, summarize_spei
 )
 
 # Page configuration
@@ -21,15 +21,6 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Load and apply custom font
-
-def load_font():
-    with open("assets/fonts/Geist-VariableFont_wght.ttf", "rb") as f:
-        font_data = base64.b64encode(f.read()).decode()
-    return font_data
-
-font_base64 = load_font()
-
 # Load Material Icons font
 st.markdown("""
 <link href="https://fonts.googleapis.com/icon?family=Material+Icons" rel="stylesheet">
@@ -37,23 +28,25 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Custom CSS with Geist font and optimizations
-st.markdown(f"""
+# The font is served from ./static (see .streamlit/config.toml) so the browser
+# caches it instead of receiving it inline on every rerun
+st.markdown("""
 <style>
-    @font-face {{
+    @font-face {
         font-family: 'Geist';
-        src: url(data:font/truetype;charset=utf-8;base64,{font_base64}) format('truetype');
+        src: url('app/static/fonts/Geist-VariableFont_wght.ttf') format('truetype');
         font-weight: 100 900;
         font-style: normal;
         font-display: swap;
-    }}
+    }
 
     /* Global font application */
-    * {{
+    * {
         font-family: 'Geist', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif !important;
         -webkit-font-smoothing: antialiased;
         -moz-osx-font-smoothing: grayscale;
         text-rendering: optimizeLegibility;
-    }}
+    }
 
     /* Preserve Material Icons for Streamlit UI elements - CRITICAL for deployment */
     button[kind="header"],
@@ -63,57 +56,59 @@ st.markdown(f"""
     [class*="st-emotion-cache"] > span,
     span[data-baseweb="icon"],
     .material-icons,
-    .material-icons-outlined {{
+    .material-icons-outlined {
         font-family: 'Material Icons', 'Material Icons Outlined', sans-serif !important;
         font-feature-settings: 'liga' !important;
         -webkit-font-feature-settings: 'liga' !important;
         text-rendering: optimizeLegibility !important;
-    }}
+    }
 
     /* Custom headers */
-    .main-header {{
+    .main-header {
         font-size: 3rem;
         font-weight: 700;
         color: #ffffff;
         text-align: center;
         margin-bottom: 1rem;
         letter-spacing: -0.02em;
-    }}
+    }
 
-    .sub-header {{
+    .sub-header {
         font-size: 1.2rem;
         font-weight: 400;
         color: #ffffff;
         text-align: center;
         margin-bottom: 2rem;
         letter-spacing: -0.01em;
-    }}
+    }
 
     /* Headings and text elements */
-    h1, h2, h3, h4, h5, h6 {{
+    h1, h2, h3, h4, h5, h6 {
         font-weight: 600;
         letter-spacing: -0.02em;
-    }}
+    }
 
-    [data-testid="stMetricLabel"] {{ font-weight: 500; }}
-    [data-testid="stMetricValue"] {{ font-weight: 600; }}
-    button, .stButton button {{ font-weight: 500; }}
+    [data-testid="stMetricLabel"] { font-weight: 500; }
+    [data-testid="stMetricValue"] { font-weight: 600; }
+    button, .stButton button { font-weight: 500; }
 
-    /* Tabs styling */
-    [data-baseweb="tab"],
-    [data-baseweb="tab"] button,
-    [data-baseweb="tab"] button div,
-    [data-baseweb="tab"] p {{
+    /* View selector styled as tabs */
+    [data-testid="stRadio"] div[role="radiogroup"] {
+        gap: 1.5rem;
+        border-bottom: 1px solid #444;
+        margin-bottom: 1rem;
+    }
+
+    [data-testid="stRadio"] div[role="radiogroup"] label p {
         font-weight: 600 !important;
         font-size: 1.1rem !important;
-    }}
-
-    [data-baseweb="tab"] p {{ margin: 0 !important; }}
+        margin: 0 !important;
+    }
 
     /* Custom div font size */
-    div.st-emotion-cache-q8sbsg {{
+    div.st-emotion-cache-q8sbsg {
         font-size: 30px !important;
-    }}
+    }
 </style>
 """, unsafe_allow_html=True)
 
@@ -124,6 +119,111 @@ def load_drought_data():
     ds = xr.open_dataset("data/spei01.nc", engine="h5netcdf")
     return ds
 
+@st.cache_resource
+def load_time_ordinals(_ds):
+    """Integer day ordinals of the dataset's time axis for nearest-date lookups"""
+    return time_values_to_ordinals(_ds.time.values)
+
+@st.cache_data(max_entries=32)
+def load_spei_slice(_ds, time_idx):
+    """Read one global SPEI time step into memory as float32
+
+    The app always reads a single time step across many lat/lon cells, so
+    the slice is read once per time_idx and shared by every region and tab.
+    SPEI only needs a few decimals, so float32 is plenty.
+    """
+    return _ds['spei'].isel(time=time_idx).astype(np.float32)
+
+@st.cache_resource
+def build_country_index(_ds, continent_name):
+    """Sampling-window index for every grid cell of a continent
+
+    The windows depend only on the grid and the country centroids, so they
+    are labeled once per continent and reused for every time step.
+
+    Returns:
+        Tuple of (countries with a centroid; flat array with each cell's
+        window in the continent slice's row-major order, -1 for cells outside
+        every window; array with each located country's window)
+    """
+    continent_data = load_continents()[continent_name]
+    country_centroids = get_country_centroids(continent_name)
+    located = [country for country in continent_data["countries"] if country in country_centroids]
+    if not located:
+        return located, None, None
+
+    lat_slice, lon_slice = create_region_slices(_ds, continent_data["region"])
+    centroid_lats = np.array([country_centroids[country][0] for country in located])
+    centroid_lons = np.array([country_centroids[country][1] for country in located])
+    # 5x5 windows for countries, 51x51 for the much larger Australian states
+    half_size = 25 if continent_name == "Australia" else 2
+    cell_windows, country_windows = sampling_window_labels(
+        _ds.lat.sel(lat=lat_slice).values, _ds.lon.sel(lon=lon_slice).values,
+        centroid_lats, centroid_lons, half_size
+    )
+    return located, cell_windows.astype(np.int16), country_windows
+
+@st.cache_data(max_entries=64)
+def continent_bundle(_ds, time_idx, continent_name):
+    """Extract a continent's SPEI slice plus map data and statistics
+
+    Cached per (time_idx, continent_name) so revisiting a tab or changing
+    an unrelated control does not re-slice and re-summarize the grid.
+    """
+    cont_region = load_continents()[continent_name]["region"]
+    lat_slice, lon_slice = create_region_slices(_ds, cont_region)
+    spei_cont = load_spei_slice(_ds, time_idx).sel(lat=lat_slice, lon=lon_slice)
+
+    # Find the valid cells once and share them with every consumer below
+    valid_idx = np.flatnonzero(~np.isnan(spei_cont.values.ravel()))
+    lats_clean, lons_clean, valid_data = prepare_mapbox_data(spei_cont, valid_idx)
+    categories = categorize_spei_array(valid_data).astype(np.uint8)
+
+    return {
+        "valid_idx": valid_idx,
+        "lats": lats_clean,
+        "lons": lons_clean,
+        "spei": valid_data,
+        "categories": categories,
+        "cat_counts": np.bincount(categories, minlength=7),
+        "stats": summarize_spei(valid_data),
+    }
+
+@st.cache_resource(max_entries=64)
+def build_continent_figure(_ds, time_idx, continent_name, mapbox_token, zoom):
+    """Mapbox figure for a continent, cached per (time_idx, continent_name, zoom)
+
+    Uses cache_resource because cache_data would pickle the figure and
+    rebuild it from its dict on every hit. Callers must not mutate it.
+    """
+    bundle = continent_bundle(_ds, time_idx, continent_name)
+    cont_region = load_continents()[continent_name]["region"]
+    return create_mapbox_figure(
+        bundle["lats"], bundle["lons"], bundle["spei"],
+        mapbox_token, np.mean(cont_region["lat"]), np.mean(cont_region["lon"]), zoom,
+        continent_name, marker_size=6, opacity=0.7
+    )
+
+@st.cache_resource(max_entries=32)
+def build_region_figure(_ds, time_idx, lat_bounds, lon_bounds, title, mapbox_token, zoom):
+    """Mapbox figure for an arbitrary lat/lon region, or None if it has no valid data
+
+    Shared across reruns like build_continent_figure; callers must not mutate it.
+    """
+    region = {"lat": list(lat_bounds), "lon": list(lon_bounds)}
+    lat_slice, lon_slice = create_region_slices(_ds, region)
+    spei_region = load_spei_slice(_ds, time_idx).sel(lat=lat_slice, lon=lon_slice)
+    lats_clean, lons_clean, spei_clean = prepare_mapbox_data(spei_region)
+    if len(spei_clean) == 0:
+        return None
+
+    center_lat = np.mean(lat_bounds)
+    center_lon = np.mean(lon_bounds)
+    return create_mapbox_figure(
+        lats_clean, lons_clean, spei_clean,
+        mapbox_token, center_lat, center_lon, zoom, title
+    )
+
 # Main title
 st.markdown('<h1 class="main-header">🌍 Global Drought Monitoring Dashboard</h1>', unsafe_allow_html=True)
 st.markdown('''
@@ -181,7 +281,7 @@ with col2:
 selected_date = pd.Timestamp(year=selected_year, month=available_months_abbr.index(selected_month) + 1, day=16)
 
 # Find closest available date using utility function
-time_idx = find_nearest_time_index(time_values, selected_date)
+time_idx = find_nearest_time_index(load_time_ordinals(ds), selected_date)
 selected_time = time_values[time_idx]
 
 # Show selected date in main area with styled sidebar pointer
@@ -221,7 +321,7 @@ else:
     selected_region = regions[region_preset]
 
 # Extract data for selected time and region
-spei_data = ds['spei'].isel(time=time_idx)
+spei_data = load_spei_slice(ds, time_idx)
 lat_slice, lon_slice = create_region_slices(ds, selected_region)
 spei_region = spei_data.sel(lat=lat_slice, lon=lon_slice)
 
@@ -238,56 +338,61 @@ st.sidebar.text(f"Region size: {len(spei_region.lat)} x {len(spei_region.lon)}")
 # Load continental data from JSON
 CONTINENTS = load_continents()
 
-# Tabs for different visualizations
-tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
-    "🗺️ Global Map",
-    "🌍 Africa",
-    "🌎 North America",
-    "🌏 Asia",
-    "🇪🇺 Europe",
-    "🌎 South America",
-    "🌏 Australia"
-])
-
-with tab1:
-    # Get Mapbox token from secrets
-    try:
-        mapbox_token = st.secrets["MAPBOX_TOKEN"]
-    except:
+# Get Mapbox token from secrets
+try:
+    mapbox_token = st.secrets["MAPBOX_TOKEN"]
+except:
+    mapbox_token = None
+
+# View selector styled as tabs. Unlike st.tabs, only the selected view is
+# rendered, so hidden continents do no work on each rerun.
+VIEW_LABELS = {
+    "Global Map": "🗺️ Global Map",
+    "Africa": "🌍 Africa",
+    "North America": "🌎 North America",
+    "Asia": "🌏 Asia",
+    "Europe": "🇪🇺 Europe",
+    "South America": "🌎 South America",
+    "Australia": "🌏 Australia"
+}
+st.radio(
+    "View",
+    list(VIEW_LABELS.keys()),
+    format_func=VIEW_LABELS.get,
+    horizontal=True,
+    label_visibility="collapsed",
+    key="active_tab"
+)
+
+if st.session_state.active_tab == "Global Map":
+    if mapbox_token is None:
         st.error("⚠️ Mapbox token not found. Please add it to `.streamlit/secrets.toml`")
-        mapbox_token = None
 
     if mapbox_token and mapbox_token != "your_mapbox_token_here":
-        # Prepare data for Mapbox
-        lats_clean, lons_clean, spei_clean = prepare_mapbox_data(spei_region)
-
-        if len(spei_clean) > 0:
-            # Calculate map center and zoom
-            center_lat = np.mean([selected_region["lat"][0], selected_region["lat"][1]])
-            center_lon = np.mean([selected_region["lon"][0], selected_region["lon"][1]])
-
-            # Adjust zoom based on region size
-            lat_range = abs(selected_region["lat"][1] - selected_region["lat"][0])
-            lon_range = abs(selected_region["lon"][1] - selected_region["lon"][0])
-            max_range = max(lat_range, lon_range)
-
-            # Calculate zoom level (approximate)
-            if max_range > 120:
-                zoom = 1
-            elif max_range > 60:
-                zoom = 2
-            elif max_range > 30:
-                zoom = 3
-            else:
-                zoom = 4
-
-            # Create map using utility function
-            fig = create_mapbox_figure(
-                lats_clean, lons_clean, spei_clean,
-                mapbox_token, center_lat, center_lon, zoom,
-                f"SPEI Drought Index - {region_preset}"
-            )
+        # Adjust zoom based on region size
+        lat_range = abs(selected_region["lat"][1] - selected_region["lat"][0])
+        lon_range = abs(selected_region["lon"][1] - selected_region["lon"][0])
+        max_range = max(lat_range, lon_range)
+
+        # Calculate zoom level (approximate)
+        if max_range > 120:
+            zoom = 1
+        elif max_range > 60:
+            zoom = 2
+        elif max_range > 30:
+            zoom = 3
+        else:
+            zoom = 4
+
+        # Cached figure for this date, region and zoom
+        fig = build_region_figure(
+            ds, time_idx,
+            tuple(selected_region["lat"]), tuple(selected_region["lon"]),
+            f"SPEI Drought Index - {region_preset}",
+            mapbox_token, zoom
+        )
 
+        if fig is not None:
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.warning("⚠️ No valid data for this region and time period")
@@ -337,23 +442,17 @@ with tab1:
 def render_continental_view(continent_name, continent_data, ds, time_idx, selected_time, mapbox_token):
     st.subheader(f"{continent_name} - {selected_time.strftime('%B %Y')}")
 
-    # Get continental region and extract data
-    cont_region = continent_data["region"]
-    spei_data_cont = ds['spei'].isel(time=time_idx)
-    lat_slice, lon_slice = create_region_slices(ds, cont_region)
-    spei_cont = spei_data_cont.sel(lat=lat_slice, lon=lon_slice)
-
-    # Calculate continental statistics
-    valid_data = spei_cont.values[~np.isnan(spei_cont.values)]
+    # Get cached continental slice, map data and statistics
+    bundle = continent_bundle(ds, time_idx, continent_name)
+    valid_data = bundle["spei"]
 
     if len(valid_data) > 0:
-        # Use category counting function for consistency
-        extreme_drought_pct = (calculate_category_count(spei_cont.values, 0) / len(valid_data)) * 100
-        severe_moderate_drought_pct = ((calculate_category_count(spei_cont.values, 1) +
-                                        calculate_category_count(spei_cont.values, 2)) / len(valid_data)) * 100
-        normal_pct = (calculate_category_count(spei_cont.values, 4) / len(valid_data)) * 100
-        wet_pct = ((calculate_category_count(spei_cont.values, 5) +
-                    calculate_category_count(spei_cont.values, 6)) / len(valid_data)) * 100
+        # Category counts are computed once per bundle and reused for metrics and columns
+        cat_counts = bundle["cat_counts"]
+        extreme_drought_pct = (cat_counts[0] / len(valid_data)) * 100
+        severe_moderate_drought_pct = ((cat_counts[1] + cat_counts[2]) / len(valid_data)) * 100
+        normal_pct = (cat_counts[4] / len(valid_data)) * 100
+        wet_pct = ((cat_counts[5] + cat_counts[6]) / len(valid_data)) * 100
 
         # Display metrics
         col1, col2, col3, col4 = st.columns(4)
@@ -370,21 +469,8 @@ def render_continental_view(continent_name, continent_data, ds, time_idx, select
 
         # Render map
         if mapbox_token and mapbox_token != "your_mapbox_token_here":
-            # Prepare data
-            lats_clean, lons_clean, spei_clean = prepare_mapbox_data(spei_cont)
-
-            if len(spei_clean) > 0:
-                center_lat = np.mean(cont_region["lat"])
-                center_lon = np.mean(cont_region["lon"])
-
-                # Create map using utility function
-                fig = create_mapbox_figure(
-                    lats_clean, lons_clean, spei_clean,
-                    mapbox_token, center_lat, center_lon, 3,
-                    continent_name, marker_size=6, opacity=0.7
-                )
-
-                st.plotly_chart(fig, use_container_width=True)
+            fig = build_continent_figure(ds, time_idx, continent_name, mapbox_token, zoom=3)
+            st.plotly_chart(fig, use_container_width=True)
 
         st.markdown("---")
 
@@ -392,49 +478,45 @@ def render_continental_view(continent_name, continent_data, ds, time_idx, select
         label = "State" if continent_name == "Australia" else "Country"
         st.subheader(f"📍 Drought Severity by {label}")
 
-        # Get country centroids for this continent
-        country_centroids = get_country_centroids(continent_name)
-
         # Categorize countries/states by drought severity
         # Australia: uses average SPEI (states are huge)
         # Other continents: uses dominant category (most common condition)
         countries = continent_data["countries"]
         country_categories = {i: [] for i in range(7)}
 
-        for country in countries:
-            if country in country_centroids:
-                lat, lon = country_centroids[country]
-                # Use larger sampling grid for Australian states (they're huge!)
-                grid_size = 50 if continent_name == "Australia" else 5
-
-                # Get SPEI values in the country's region
-                valid_values = get_region_spei_values(spei_cont, lat, lon, grid_size)
-
-                if len(valid_values) > 0:
-                    if continent_name == "Australia":
-                        # For Australian states, use AVERAGE SPEI (states are too large for dominant category)
-                        avg_spei = np.mean(valid_values)
-                        category = categorize_spei(avg_spei)
-                        country_categories[category].append(country)
-                    else:
-                        # For other countries, use DOMINANT category (most common)
-                        categorized = np.array([categorize_spei(v) for v in valid_values])
-
-                        # Count occurrences of each category
-                        category_counts = np.bincount(categorized, minlength=7)
-
-                        # Assign country to the category with the most occurrences
-                        dominant_category = np.argmax(category_counts)
-                        country_categories[dominant_category].append(country)
-                else:
-                    # No valid data, use continental mean as fallback
-                    category = categorize_spei(np.nanmean(spei_cont.values))
-                    country_categories[category].append(country)
+        # Continental mean category, used for countries without a centroid or data
+        fallback_category = categorize_spei(bundle["stats"]["Mean SPEI"])
+
+        # Every valid cell belongs to the sampling window of its nearest
+        # country/state centroid, so all per-country results come from one
+        # labeled reduction over the cells
+        located, cell_windows, country_windows = build_country_index(ds, continent_name)
+        located_categories = {}
+        if located:
+            # Cells outside every sampling window are labeled -1
+            valid_windows = cell_windows[bundle["valid_idx"]]
+            assigned = valid_windows >= 0
+            valid_windows = valid_windows[assigned]
+            n_windows = country_windows.max() + 1
+            if continent_name == "Australia":
+                window_means = mean_by_group(valid_windows, valid_data[assigned], n_windows)
+                has_data = ~np.isnan(window_means)
+                window_categories = categorize_spei_array(window_means)
             else:
-                # If no centroid, use continental mean
-                continent_mean = np.nanmean(spei_cont.values)
-                category = categorize_spei(continent_mean)
-                country_categories[category].append(country)
+                window_hist = category_histogram_by_group(
+                    valid_windows, bundle["categories"][assigned], n_windows
+                )
+                has_data = window_hist.sum(axis=1) > 0
+                window_categories = window_hist.argmax(axis=1)
+            located_categories = {
+                country: int(window_categories[window])
+                for country, window in zip(located, country_windows)
+                if has_data[window]
+            }
+
+        for country in countries:
+            category = located_categories.get(country, fallback_category)
+            country_categories[category].append(country)
 
         # Create 7 columns for each category
         cols = st.columns(7)
@@ -446,7 +528,7 @@ def render_continental_view(continent_name, continent_data, ds, time_idx, select
                 st.markdown(f"<div style='font-size: 16px; font-weight: 600; margin-bottom: 10px;'>{dot} {label}</div>", unsafe_allow_html=True)
 
                 # Calculate percentage of region in this category
-                cat_count = calculate_category_count(spei_cont.values, idx)
+                cat_count = cat_counts[idx]
                 pct = (cat_count / total_points * 100) if total_points > 0 else 0
                 st.markdown(f"<div style='font-size: 18px; font-weight: 600; margin-bottom: 15px; color: {color};'>{pct:.1f}%</div>", unsafe_allow_html=True)
 
@@ -465,17 +547,12 @@ def render_continental_view(continent_name, continent_data, ds, time_idx, select
         # Data table
         st.subheader("📊 Regional Statistics")
 
-        # Use valid_data for statistics to avoid warnings
-        if len(valid_data) > 0:
+        # Statistics are precomputed on valid_data in the cached bundle
+        stats = bundle["stats"]
+        if stats is not None:
             stats_df = pd.DataFrame({
-                "Metric": ["Mean SPEI", "Median SPEI", "Std Dev", "Min SPEI", "Max SPEI"],
-                "Value": [
-                    f"{np.mean(valid_data):.3f}",
-                    f"{np.median(valid_data):.3f}",
-                    f"{np.std(valid_data):.3f}",
-                    f"{np.min(valid_data):.3f}",
-                    f"{np.max(valid_data):.3f}"
-                ]
+                "Metric": list(stats.keys()),
+                "Value": [f"{value:.3f}" for value in stats.values()]
             })
             st.dataframe(stats_df, use_container_width=True, hide_index=True)
         else:
@@ -483,24 +560,10 @@ def render_continental_view(continent_name, continent_data, ds, time_idx, select
     else:
         st.warning("⚠️ No valid data for this continent in the selected time period.")
 
-# Render each continental tab
-with tab2:
-    render_continental_view("Africa", CONTINENTS["Africa"], ds, time_idx, selected_time, mapbox_token)
-
-with tab3:
-    render_continental_view("North America", CONTINENTS["North America"], ds, time_idx, selected_time, mapbox_token)
-
-with tab4:
-    render_continental_view("Asia", CONTINENTS["Asia"], ds, time_idx, selected_time, mapbox_token)
-
-with tab5:
-    render_continental_view("Europe", CONTINENTS["Europe"], ds, time_idx, selected_time, mapbox_token)
-
-with tab6:
-    render_continental_view("South America", CONTINENTS["South America"], ds, time_idx, selected_time, mapbox_token)
-
-with tab7:
-    render_continental_view("Australia", CONTINENTS["Australia"], ds, time_idx, selected_time, mapbox_token)
+# Render the selected continental view
+if st.session_state.active_tab in CONTINENTS:
+    active_continent = st.session_state.active_tab
+    render_continental_view(active_continent, CONTINENTS[active_continent], ds, time_idx, selected_time, mapbox_token)
 
 # Footer
 st.markdown("---")
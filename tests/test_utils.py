@@ -0,0 +1,76 @@
+import numpy as np
+
+from utils import (
+    SPEI_MARKER_COLORS, SPEI_MARKER_COLORSCALE,
+    canvas_marker_budget, sampling_window_labels, spei_to_color_codes, summarize_spei
+)
+
+
+LAT_VALS = np.arange(30.25, 40, 0.5)
+LON_VALS = np.arange(50.25, 60, 0.5)
+
+
+def test_single_centroid_samples_a_clipped_window():
+    cell_windows, centroid_windows = sampling_window_labels(
+        LAT_VALS, LON_VALS, np.array([30.3]), np.array([55.2]), half_size=2
+    )
+    grid = cell_windows.reshape(len(LAT_VALS), len(LON_VALS))
+
+    assert centroid_windows.tolist() == [0]
+    # Window rows are clipped at the grid edge: 3 rows x 5 columns
+    assert (grid == 0).sum() == 15
+    assert (grid[:3, 8:13] == 0).all()
+
+
+def test_coincident_centroids_share_a_window():
+    # The first two centroids snap to the same grid cell
+    cell_windows, centroid_windows = sampling_window_labels(
+        LAT_VALS, LON_VALS,
+        np.array([35.2, 35.3, 32.2]), np.array([55.2, 55.3, 52.2]), half_size=2
+    )
+
+    assert centroid_windows[0] == centroid_windows[1]
+    assert centroid_windows[0] != centroid_windows[2]
+    assert (cell_windows == centroid_windows[0]).sum() == 25
+    assert (cell_windows == centroid_windows[2]).sum() == 25
+
+
+def test_overlapping_windows_split_cells_by_distance():
+    cell_windows, centroid_windows = sampling_window_labels(
+        LAT_VALS, LON_VALS, np.array([35.25, 35.25]), np.array([54.25, 55.75]), half_size=2
+    )
+    grid = cell_windows.reshape(len(LAT_VALS), len(LON_VALS))
+    row = grid[np.searchsorted(LAT_VALS, 35.25)]
+
+    # Windows span columns 6..10 and 9..13 and meet between 54.75 and 55.25
+    assert row[6:10].tolist() == [centroid_windows[0]] * 4
+    assert row[10:14].tolist() == [centroid_windows[1]] * 4
+    assert (cell_windows >= 0).sum() == 40
+
+
+def test_summary_of_float32_values_matches_float64_reference():
+    values = np.random.default_rng(0).normal(0.3, 1.2, 1_000_000).astype(np.float32)
+    stats = summarize_spei(values)
+    reference = values.astype(np.float64)
+
+    assert np.isclose(stats["Mean SPEI"], reference.mean(), rtol=0, atol=1e-12)
+    assert np.isclose(stats["Std Dev"], reference.std(), rtol=0, atol=1e-9)
+    assert summarize_spei(np.array([], dtype=np.float32)) is None
+
+
+def test_color_codes_land_in_their_own_colorscale_band():
+    codes = spei_to_color_codes(np.array([-2.0004, -2.0, -0.5, 0.4999, 0.5, 1.5, 3.0]))
+    assert codes.tolist() == [0, 1, 4, 4, 5, 7, 7]
+
+    # Plotly places code c at c / cmax along the colorscale
+    cmax = len(SPEI_MARKER_COLORS) - 1
+    for code, color in enumerate(SPEI_MARKER_COLORS):
+        (start, band_color), (end, _) = SPEI_MARKER_COLORSCALE[2 * code:2 * code + 2]
+        assert band_color == color
+        assert start <= code / cmax <= end
+
+
+def test_single_row_region_keeps_a_marker_budget_along_its_length():
+    # 80 cells in one row at lat 10.25 span ~900 px at zoom 4
+    budget = canvas_marker_budget((10.25, 10.25), (0.25, 39.75), zoom=4, marker_size=8)
+    assert budget >= 80
@@ -2,6 +2,7 @@
 import json
 import numpy as np
 import plotly.graph_objects as go
+import streamlit as st
 
 # SPEI category definitions
 SPEI_CATEGORIES = [
@@ -14,6 +15,27 @@ SPEI_CATEGORIES = [
     ("Very Wet", '#0000FF', '🔵')
 ]
 
+# Map marker colors: bins are closed on the left, one more color than bins
+SPEI_COLOR_BINS = np.array([-2, -1.5, -1, -0.5, 0.5, 1, 1.5])
+SPEI_MARKER_COLORS = [
+    '#8B0000',  # Extreme drought
+    '#FF4500',  # Severe drought
+    '#FFA500',  # Moderate drought
+    '#FFD700',  # Mild drought
+    '#90EE90',  # Normal
+    '#00FF00',  # Slightly wet
+    '#00CED1',  # Wet
+    '#0000FF'   # Very wet
+]
+
+# Stepped colorscale so integer color codes 0..7 (cmin=0, cmax=7) each map
+# to one flat band instead of plotly validating a color string per point
+SPEI_MARKER_COLORSCALE = [
+    [position, color]
+    for i, color in enumerate(SPEI_MARKER_COLORS)
+    for position in (i / len(SPEI_MARKER_COLORS), (i + 1) / len(SPEI_MARKER_COLORS))
+]
+
 
 def create_region_slices(ds, region):
     """Create lat/lon slices based on data ordering and region bounds"""
@@ -33,6 +55,7 @@ def create_region_slices(ds, region):
     return lat_slice, lon_slice
 
 
+@st.cache_data
 def load_continents():
     """Load continent data from JSON file"""
     with open('data/continents.json', 'r') as f:
@@ -52,6 +75,7 @@ def get_regions_dict():
     return regions
 
 
+@st.cache_data
 def load_country_centroids():
     """Load country centroid coordinates from JSON file"""
     with open('data/country_centroids.json', 'r') as f:
@@ -66,24 +90,9 @@ def get_country_centroids(continent_name):
     return {country: tuple(coords) for country, coords in centroids.items()}
 
 
-def spei_to_color(spei_val):
-    """Convert SPEI value to color code"""
-    if spei_val < -2:
-        return '#8B0000'  # Extreme drought
-    elif spei_val < -1.5:
-        return '#FF4500'  # Severe drought
-    elif spei_val < -1:
-        return '#FFA500'  # Moderate drought
-    elif spei_val < -0.5:
-        return '#FFD700'  # Mild drought
-    elif spei_val < 0.5:
-        return '#90EE90'  # Normal
-    elif spei_val < 1:
-        return '#00FF00'  # Slightly wet
-    elif spei_val < 1.5:
-        return '#00CED1'  # Wet
-    else:
-        return '#0000FF'  # Very wet
+def spei_to_color_codes(spei_values):
+    """Convert an array of SPEI values to indices into SPEI_MARKER_COLORS"""
+    return np.digitize(spei_values, SPEI_COLOR_BINS)
 
 
 def get_legend_traces():
@@ -131,99 +140,204 @@ def categorize_spei(spei_val):
         return 6  # Very Wet
 
 
-def calculate_category_count(spei_values, category_idx):
-    """Calculate count of values in a specific SPEI category"""
-    thresholds = [
-        (lambda v: v < -2),                                    # 0: Extreme
-        (lambda v: (v >= -2) & (v < -1.5)),                   # 1: Severe
-        (lambda v: (v >= -1.5) & (v < -1)),                   # 2: Moderate
-        (lambda v: (v >= -1) & (v < -0.5)),                   # 3: Mild
-        (lambda v: (v >= -0.5) & (v <= 0.5)),                 # 4: Normal
-        (lambda v: (v > 0.5) & (v <= 1.5)),                   # 5: Wet
-        (lambda v: v > 1.5)                                    # 6: Very Wet
-    ]
-    return np.sum(thresholds[category_idx](spei_values))
+def categorize_spei_array(spei_values):
+    """Categorize an array of SPEI values in one pass
+
+    Matches categorize_spei element-wise: drought bins are closed on the
+    left, wet bins on the right, and NaN values default to normal.
+    """
+    spei_values = np.asarray(spei_values)
+    categories = (np.digitize(spei_values, [-2, -1.5, -1, -0.5]) +
+                  np.digitize(spei_values, [0.5, 1.5], right=True))
+    categories[np.isnan(spei_values)] = 4
+    return categories
+
 
+def summarize_spei(valid_values):
+    """Summary statistics of valid SPEI values for the statistics table
 
-def get_region_spei_values(spei_data, lat, lon, grid_size=5):
-    """Get all SPEI values in a region around a coordinate
+    Mean and standard deviation are derived from the sum and sum of squares,
+    avoiding the centred temporary array np.std allocates. Both sums are
+    accumulated in float64 because the slices are stored as float32.
+
+    Returns:
+        Dict of metric name to value, or None if there are no values
+    """
+    n = len(valid_values)
+    if n == 0:
+        return None
+    mean = np.sum(valid_values, dtype=np.float64) / n
+    mean_sq = np.einsum('i,i->', valid_values, valid_values, dtype=np.float64) / n
+    return {
+        "Mean SPEI": mean,
+        "Median SPEI": np.median(valid_values),
+        "Std Dev": np.sqrt(max(mean_sq - mean ** 2, 0.0)),
+        "Min SPEI": np.min(valid_values),
+        "Max SPEI": np.max(valid_values),
+    }
+
+
+def sampling_window_labels(lat_vals, lon_vals, centroid_lats, centroid_lons, half_size):
+    """Assign every grid cell to the sampling window of its nearest centroid
+
+    Each centroid is snapped to its nearest grid cell and samples half_size
+    cells on either side of it. Centroids that snap to the same cell share
+    one window, so they all see the same cells. Cells covered by several
+    windows go to the nearest window centre, using an equirectangular
+    distance (longitude differences scaled by the cosine of the latitude).
 
     Args:
-        spei_data: xarray dataset with SPEI values
-        lat: latitude coordinate
-        lon: longitude coordinate
-        grid_size: size of grid to sample (default 5 for 5x5, use larger for big regions)
+        lat_vals, lon_vals: 1-D grid coordinates
+        centroid_lats, centroid_lons: arrays of centroid coordinates
+        half_size: window half-width in grid cells
 
     Returns:
-        Array of valid SPEI values in the region (NaN values removed)
+        Tuple of (window index for each cell of the flattened lat x lon grid,
+        or -1 for cells outside every window; window index for each centroid)
     """
-    try:
-        # Find nearest grid points
-        lat_idx = np.abs(spei_data.lat.values - lat).argmin()
-        lon_idx = np.abs(spei_data.lon.values - lon).argmin()
+    lat_vals = np.asarray(lat_vals)
+    lon_vals = np.asarray(lon_vals)
+    lat_idx = np.abs(lat_vals[None, :] - np.asarray(centroid_lats)[:, None]).argmin(axis=1)
+    lon_idx = np.abs(lon_vals[None, :] - np.asarray(centroid_lons)[:, None]).argmin(axis=1)
+    windows, centroid_windows = np.unique(
+        np.column_stack([lat_idx, lon_idx]), axis=0, return_inverse=True
+    )
 
-        # Sample a grid around the point
-        half_size = grid_size // 2
-        lat_start = max(0, lat_idx - half_size)
-        lat_end = min(len(spei_data.lat), lat_idx + half_size + 1)
-        lon_start = max(0, lon_idx - half_size)
-        lon_end = min(len(spei_data.lon), lon_idx + half_size + 1)
+    cell_lat_idx = np.repeat(np.arange(len(lat_vals)), len(lon_vals))
+    cell_lon_idx = np.tile(np.arange(len(lon_vals)), len(lat_vals))
+    outside = ((np.abs(cell_lat_idx[:, None] - windows[None, :, 0]) > half_size) |
+               (np.abs(cell_lon_idx[:, None] - windows[None, :, 1]) > half_size))
 
-        # Get values from the region
-        region_values = spei_data.values[lat_start:lat_end, lon_start:lon_end]
-        valid_values = region_values[~np.isnan(region_values)]
+    cell_lats = lat_vals[cell_lat_idx]
+    lon_scale = np.cos(np.radians(cell_lats))[:, None]
+    d_lat = cell_lats[:, None] - lat_vals[windows[:, 0]][None, :]
+    d_lon = (lon_vals[cell_lon_idx][:, None] - lon_vals[windows[:, 1]][None, :]) * lon_scale
+    dist_sq = d_lat ** 2 + d_lon ** 2
+    dist_sq[outside] = np.inf
 
-        return valid_values
-    except:
-        return np.array([])
+    cell_windows = np.argmin(dist_sq, axis=1)
+    cell_windows[outside.all(axis=1)] = -1
+    return cell_windows, centroid_windows.ravel()
 
 
-def get_spei_at_location(spei_data, lat, lon, grid_size=5):
-    """Get average SPEI value in a region around a coordinate
+def category_histogram_by_group(group_ids, categories, n_groups):
+    """Count SPEI categories per group in a single bincount
 
-    Args:
-        spei_data: xarray dataset with SPEI values
-        lat: latitude coordinate
-        lon: longitude coordinate
-        grid_size: size of grid to sample (default 5 for 5x5, use larger for big regions)
+    Returns:
+        Array of shape (n_groups, 7) with category counts for each group
     """
-    valid_values = get_region_spei_values(spei_data, lat, lon, grid_size)
-    if len(valid_values) > 0:
-        return np.mean(valid_values)
-    else:
-        return np.nan
+    flat_ids = np.asarray(group_ids) * 7 + np.asarray(categories)
+    return np.bincount(flat_ids, minlength=n_groups * 7).reshape(n_groups, 7)
+
+
+def mean_by_group(group_ids, values, n_groups):
+    """Mean of values per group in a single bincount
 
+    Returns:
+        Array of n_groups means, NaN for groups without values
+    """
+    counts = np.bincount(group_ids, minlength=n_groups)
+    sums = np.bincount(group_ids, weights=values, minlength=n_groups)
+    with np.errstate(invalid='ignore'):
+        return sums / counts
 
-def prepare_mapbox_data(spei_region_data):
+
+def prepare_mapbox_data(spei_region_data, valid_idx=None):
     """Prepare SPEI data for Mapbox visualization
 
     Args:
         spei_region_data: xarray DataArray with SPEI values
+        valid_idx: flat indices of the non-NaN cells, if already computed
 
     Returns:
         Tuple of (lats_clean, lons_clean, spei_clean) with NaN values removed
     """
-    # Create meshgrid
-    lons, lats = np.meshgrid(spei_region_data.lon.values, spei_region_data.lat.values)
-    lons_flat = lons.flatten()
-    lats_flat = lats.flatten()
-    spei_flat = spei_region_data.values.flatten()
-
-    # Remove NaN values
-    mask = ~np.isnan(spei_flat)
-    lons_clean = lons_flat[mask]
-    lats_clean = lats_flat[mask]
-    spei_clean = spei_flat[mask]
+    # Map flat indices of valid cells back to their lat/lon rows and columns
+    # instead of materializing a full meshgrid
+    spei_flat = spei_region_data.values.ravel()
+    if valid_idx is None:
+        valid_idx = np.flatnonzero(~np.isnan(spei_flat))
+    n_lon = spei_region_data.sizes['lon']
+
+    lats_clean = spei_region_data.lat.values[valid_idx // n_lon]
+    lons_clean = spei_region_data.lon.values[valid_idx % n_lon]
+    spei_clean = spei_flat[valid_idx]
 
     return lats_clean, lons_clean, spei_clean
 
 
-def create_mapbox_figure(lats, lons, spei_values, mapbox_token, center_lat, center_lon, zoom, title, marker_size=8, opacity=0.3):
+def downsample_for_mapbox(lats, lons, spei_values, lat_range, lon_range, max_markers=20000):
+    """Aggregate SPEI points onto a coarser lat/lon grid for Mapbox
+
+    Args:
+        lats, lons, spei_values: flat arrays of valid points
+        lat_range, lon_range: (min, max) extent used for the bin edges
+        max_markers: upper bound on the number of points returned
+
+    Returns:
+        Tuple of (lats, lons, spei_values) with one point per non-empty bin,
+        placed at the mean position of its cells and colored by their mean SPEI.
+        Inputs with at most max_markers points are returned unchanged.
+    """
+    if len(spei_values) <= max_markers:
+        return lats, lons, spei_values
+
+    n_bins = int(np.sqrt(max_markers))
+    lat_edges = np.linspace(lat_range[0], lat_range[1], n_bins + 1)
+    lon_edges = np.linspace(lon_range[0], lon_range[1], n_bins + 1)
+    lat_bins = np.clip(np.digitize(lats, lat_edges) - 1, 0, n_bins - 1)
+    lon_bins = np.clip(np.digitize(lons, lon_edges) - 1, 0, n_bins - 1)
+    bin_ids = lat_bins * n_bins + lon_bins
+
+    # Accumulate per-bin sums and counts, then keep only occupied bins
+    counts = np.bincount(bin_ids, minlength=n_bins * n_bins)
+    occupied = counts > 0
+    counts = counts[occupied]
+
+    def bin_mean(values):
+        sums = np.bincount(bin_ids, weights=values, minlength=n_bins * n_bins)
+        return sums[occupied] / counts
+
+    return bin_mean(lats), bin_mean(lons), bin_mean(spei_values)
+
+
+def canvas_marker_budget(lat_range, lon_range, zoom, marker_size):
+    """Number of marker-sized cells a region covers on screen at a zoom level
+
+    Uses the Web Mercator size of the 512 px Mapbox world at the given zoom,
+    so the budget follows the pixels drawn rather than the data resolution.
+    Each dimension holds at least one marker, so a single row or column of
+    cells is budgeted along its length instead of collapsing to one point.
+    """
+    world_px = 512 * 2 ** zoom
+    lat_bounds = np.radians(np.clip(lat_range, -85, 85))
+    mercator_y = np.log(np.tan(np.pi / 4 + lat_bounds / 2))
+    height_px = abs(mercator_y[1] - mercator_y[0]) / (2 * np.pi) * world_px
+    width_px = abs(lon_range[1] - lon_range[0]) / 360 * world_px
+    return max(1, int(height_px / marker_size)) * max(1, int(width_px / marker_size))
+
+
+def create_mapbox_figure(lats, lons, spei_values, mapbox_token, center_lat, center_lon, zoom, title, marker_size=8, opacity=0.3, max_markers=20000):
     """Create a standardized Mapbox figure with SPEI data"""
     fig = go.Figure()
 
-    # Convert SPEI values to colors
-    colors = [spei_to_color(val) for val in spei_values]
+    # Aggregate dense grids to what the initial view can actually show,
+    # never sending more than max_markers points to the browser
+    if len(spei_values) > 0:
+        lat_range = (np.min(lats), np.max(lats))
+        lon_range = (np.min(lons), np.max(lons))
+        marker_budget = min(max_markers, canvas_marker_budget(lat_range, lon_range, zoom, marker_size))
+        lats, lons, spei_values = downsample_for_mapbox(
+            lats, lons, spei_values, lat_range, lon_range, marker_budget
+        )
+
+    # Convert SPEI values to color codes before any rounding so bin edges are exact
+    color_codes = spei_to_color_codes(spei_values)
+
+    # Grid cells are 0.5 degrees apart, so extra float digits only bloat the payload
+    lats = np.round(lats, 4)
+    lons = np.round(lons, 4)
+    hover_spei = np.round(spei_values, 3)
 
     # Add scatter points
     fig.add_trace(go.Scattermapbox(
@@ -232,11 +346,14 @@ def create_mapbox_figure(lats, lons, spei_values, mapbox_token, center_lat, cent
         mode='markers',
         marker=dict(
             size=marker_size,
-            color=colors,
+            color=color_codes,
+            colorscale=SPEI_MARKER_COLORSCALE,
+            cmin=0,
+            cmax=len(SPEI_MARKER_COLORS) - 1,
             opacity=opacity
         ),
-        text=[f'SPEI: {val:.2f}' for val in spei_values],
-        hovertemplate='<b>%{text}</b><br>Lat: %{lat:.2f}<br>Lon: %{lon:.2f}<extra></extra>',
+        customdata=hover_spei,
+        hovertemplate='<b>SPEI: %{customdata:.2f}</b><br>Lat: %{lat:.2f}<br>Lon: %{lon:.2f}<extra></extra>',
         name='Drought Data',
         showlegend=False
     ))
@@ -273,7 +390,25 @@ def create_mapbox_figure(lats, lons, spei_values, mapbox_token, center_lat, cent
     return fig
 
 
-def find_nearest_time_index(time_values, target_date):
-    """Find the index of the nearest time value to target_date"""
-    time_diffs = np.abs([(tv - target_date).days for tv in time_values])
-    return int(np.argmin(time_diffs))
+def time_values_to_ordinals(time_values):
+    """Convert datetime-like time values to integer day ordinals"""
+    return np.asarray(time_values, dtype='datetime64[D]').astype(np.int64)
+
+
+def find_nearest_time_index(time_ordinals, target_date):
+    """Find the index of the nearest time value to target_date
+
+    Args:
+        time_ordinals: sorted integer day ordinals from time_values_to_ordinals
+        target_date: date-like value to look up
+    """
+    target_ordinal = np.datetime64(target_date, 'D').astype(np.int64)
+    i = int(np.searchsorted(time_ordinals, target_ordinal))
+    if i == 0:
+        return 0
+    if i == len(time_ordinals):
+        return i - 1
+    # Ties resolve to the earlier date
+    if time_ordinals[i] - target_ordinal < target_ordinal - time_ordinals[i - 1]:
+        return i
+    return i - 1